@@ -0,0 +1,64 @@
+import contextlib
+import dataclasses
+import sys
+import time
+from pathlib import Path
+from typing import Iterator, List
+
+HELPER = Path(__file__).with_name("measure_helper.py")
+
+
+@dataclasses.dataclass
+class ResourceUsage(object):
+    """Resources used by measured blocks and the processes run through the helper."""
+
+    wall_time: float = 0.0
+    user_time: float = 0.0
+    system_time: float = 0.0
+    # Peak resident set size of the largest single process, in KiB. Includes the
+    # few MiB of the measuring helper the process is started from.
+    peak_memory: int = 0
+    processes: int = 0
+
+    def add_processes(self, other: "ResourceUsage"):
+        self.user_time += other.user_time
+        self.system_time += other.system_time
+        self.peak_memory = max(self.peak_memory, other.peak_memory)
+        self.processes += other.processes
+
+    def add(self, other: "ResourceUsage"):
+        self.wall_time += other.wall_time
+        self.add_processes(other)
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+
+def helper_command(report: Path) -> List[str]:
+    """Prefix for a command which runs it through the measuring helper, writing
+    its resource usage to the given report file."""
+    return [sys.executable, "-I", "-S", str(HELPER), str(report)]
+
+
+def read_report(report: Path) -> ResourceUsage:
+    try:
+        user_time, system_time, peak_memory = report.read_text().split()
+    except (OSError, ValueError):
+        # The helper was killed before it could write the report
+        return ResourceUsage()
+    return ResourceUsage(
+        user_time=float(user_time),
+        system_time=float(system_time),
+        peak_memory=int(peak_memory),
+        processes=1,
+    )
+
+
+@contextlib.contextmanager
+def measure(usage: ResourceUsage) -> Iterator[ResourceUsage]:
+    """Adds the wall time spent in the block to the given usage."""
+    start = time.perf_counter()
+    try:
+        yield usage
+    finally:
+        usage.wall_time += time.perf_counter() - start
@@ -0,0 +1,132 @@
+import asyncio
+import json
+import logging
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+
+from status import StatusBoard, Snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class StatusApplication(object):
+    """ASGI front end serving job status from the status board on the event loop.
+
+    `/status` pages and the `/events` stream are answered directly from the
+    precomputed snapshots without occupying a thread, every other request is
+    handed to the wrapped WSGI application.
+    """
+
+    EVENT_QUEUE_SIZE = 256
+
+    def __init__(self, wsgi_app, board: StatusBoard):
+        self.wsgi = WsgiToAsgi(wsgi_app)
+        self.board = board
+
+    @staticmethod
+    def _query(scope):
+        return dict(parse_qsl(scope["query_string"].decode("latin-1")))
+
+    @staticmethod
+    async def _send_json(send, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "GET":
+            if scope["path"] == "/status":
+                return await self._status(scope, send)
+            if scope["path"] == "/events":
+                return await self._events(scope, receive, send)
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        return await self.wsgi(scope, receive, send)
+
+    async def _status(self, scope, send):
+        try:
+            after, limit, filters = StatusBoard.parse_query(self._query(scope))
+            status, cursor = self.board.page(after, limit, filters)
+        except ValueError as e:
+            return await self._send_json(send, {"success": False, "errors": [str(e)]})
+        await self._send_json(send, {"success": True, "status": status, "next": cursor})
+
+    async def _events(self, scope, receive, send):
+        job_id: Optional[str] = self._query(scope).get("id")
+        loop = asyncio.get_running_loop()
+        queue: "asyncio.Queue[Snapshot]" = asyncio.Queue(
+            maxsize=StatusApplication.EVENT_QUEUE_SIZE
+        )
+
+        def offer(snapshot: Snapshot):
+            if queue.full():
+                # Slow consumer, drop the oldest event since it is superseded anyway
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+
+        def listener(snapshot: Snapshot):
+            if job_id is not None and snapshot["id"] != job_id:
+                return
+            try:
+                loop.call_soon_threadsafe(offer, snapshot)
+            except RuntimeError:
+                # Event loop already closed
+                pass
+
+        self.board.subscribe(listener)
+        disconnect = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", b"text/event-stream"),
+                        (b"cache-control", b"no-cache"),
+                    ],
+                }
+            )
+            if job_id is not None and (current := self.board.get(job_id)):
+                offer(current)
+
+            while True:
+                event = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait(
+                    {event, disconnect}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if disconnect in done:
+                    event.cancel()
+                    break
+                data = json.dumps(event.result())
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": f"data: {data}\n\n".encode("utf-8"),
+                        "more_body": True,
+                    }
+                )
+        finally:
+            self.board.unsubscribe(listener)
+            disconnect.cancel()
@@ -1,14 +1,27 @@
+import contextlib
 import dataclasses
 import enum
+import hashlib
 import logging
 import math
 import random
 import re
+import secrets
 import shutil
 import tempfile
-from collections import defaultdict
+import threading
+from collections import OrderedDict, defaultdict
 from pathlib import Path
-from typing import Dict, Tuple, Optional, List, Collection, Iterable
+from typing import (
+    Callable,
+    Collection,
+    ContextManager,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
 
 from problemtools import languages, verifyproblem
 from problemtools.run import SourceCode, Program
@@ -20,6 +33,9 @@ from problemtools.verifyproblem import (
 )
 from pydomjudge.repository.kattis import RepositoryProblem, ExecutionError
 
+import accounting
+from accounting import ResourceUsage
+
 logger = logging.getLogger(__name__)
 
 
@@ -95,6 +111,39 @@ class ProblemLayout(object):
                 second_part.pop()
         return first_part, second_part
 
+    @staticmethod
+    def split_answers(answer_file: Path, cases: int) -> Optional[List[List[str]]]:
+        """Splits an answer into the lines of each case at its Case # markers.
+        Returns None if the answer is not made of the given number of marked
+        cases."""
+        with answer_file.open(mode="rt") as f:
+            lines = f.read().splitlines()
+
+        answers = []
+        for line in lines:
+            if line.startswith("Case #"):
+                answers.append([line])
+            elif answers:
+                answers[-1].append(line)
+            else:
+                return None
+        if len(answers) != cases:
+            return None
+        return answers
+
+    @staticmethod
+    def assemble_answer(
+        answers: List[List[str]], case_numbers: Iterable[int]
+    ) -> List[str]:
+        """Builds the answer to the input consisting of the given (1-based)
+        cases from the split answers, renumbering the Case # markers."""
+        result = []
+        for position, case_number in enumerate(case_numbers, start=1):
+            first, *rest = answers[case_number - 1]
+            result.append(re.sub(r"^Case #\d+", f"Case #{position}", first))
+            result += rest
+        return result
+
     def pick_case(self, input_file, case_number):
         with input_file.open(mode="rt") as f:
             cases = int(f.readline())
@@ -118,6 +167,7 @@ class RunVerdict(enum.Enum):
     COMPILE_ERROR = "CE"
     JUDGE_ERROR = "JE"
     FEEDBACK_INCONSISTENCY = "INC"
+    MEMORY_LIMIT_EXCEEDED = "MLE"
 
     @staticmethod
     def get(key):
@@ -139,9 +189,20 @@ class RunResult(object):
         answer_file: Path,
         verdict: RunVerdict,
         feedback: Dict[str, str],
+        usage: Dict[str, ResourceUsage],
+        run: int,
+        cached: bool = False,
     ):
         self.verdict = verdict
         self.feedback = feedback
+        # Resources used by the "submission" and the "input" and "answer" generation,
+        # the latter only report wall time since the repository starts their processes
+        self.usage = usage
+        # Whether the input and answer were taken from the cache, in which case no
+        # generation usage is reported
+        self.cached = cached
+        # Index of the run, together with the job seed this reproduces the run
+        self.run = run
 
         self.problem = problem
 
@@ -155,11 +216,106 @@ class RunResult(object):
             self.answer = f.read()
 
 
+@dataclasses.dataclass
+class GeneratedData(object):
+    input: str
+    answer: str
+
+    @property
+    def size(self) -> int:
+        return len(self.input) + len(self.answer)
+
+
+class GeneratedDataCache(object):
+    """Cache of generated inputs and answers shared between jobs, bounded by the
+    total size of the cached data.
+
+    Entries are keyed by problem, the modification time of its generators and
+    solutions and the contents of the randomized seed file, so identical jobs
+    (same problem, case and job seed) skip the generation.
+    """
+
+    # Files the generated input and answer depend on, relative to the problem
+    SOURCES = ("generators", "submissions/accepted", "problem.yaml")
+
+    @staticmethod
+    def source_version(problem_directory: Path) -> int:
+        """Latest modification time of the generators and solutions."""
+        latest = 0
+        for name in GeneratedDataCache.SOURCES:
+            path = problem_directory / name
+            if not path.exists():
+                continue
+            for file in [path, *path.rglob("*")]:
+                latest = max(latest, file.stat().st_mtime_ns)
+        return latest
+
+    def __init__(self, max_size: int = 64 * 1024 * 1024):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._size = 0
+        self._entries: "OrderedDict[Tuple[str, int, str], GeneratedData]" = (
+            OrderedDict()
+        )
+
+    def get(self, key: Tuple[str, int, str]) -> Optional[GeneratedData]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Tuple[str, int, str], data: GeneratedData):
+        if data.size > self.max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous.size
+            self._entries[key] = data
+            self._size += data.size
+            while self._size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+
+
 class SeedStructure(enum.Enum):
     MULTIPLE_CASES = "multiple"
     SINGLE_CASE = "single"
 
 
+class _MeasuredProgram(object):
+    """Delegates to the wrapped program, starting its runs through the measuring
+    helper to account the resources of the program process itself."""
+
+    def __init__(self, program: Program, usage: ResourceUsage, report: Path):
+        self._program = program
+        self._usage = usage
+        self._report = report
+
+    def get_runcmd(self, *args, **kwargs):
+        return accounting.helper_command(self._report) + self._program.get_runcmd(
+            *args, **kwargs
+        )
+
+    def run(self, *args, **kwargs):
+        self._report.unlink(missing_ok=True)
+        with accounting.measure(self._usage):
+            # Program.run only calls back into get_runcmd and its private
+            # helpers, so running it on this proxy injects the helper
+            status, runtime = Program.run(self, *args, **kwargs)
+        report = accounting.read_report(self._report)
+        self._usage.add_processes(report)
+        if report.processes == 0:
+            # No report written, fall back to the runtime including the helper
+            return status, runtime
+        # Judge the runtime of the program alone, without the helper's startup
+        return status, report.user_time + report.system_time
+
+    def __getattr__(self, name):
+        return getattr(self._program, name)
+
+
 class FuzzingRun(object):
     RANDOM_RUNS = 200
 
@@ -248,10 +404,18 @@ class FuzzingRun(object):
         submission_logger: logging.Logger,
         case_seed_file: Path,
         fuzzing_directory: Path,
+        run: int,
+        run_seed: int,
+        memory_limit: Optional[int] = None,
+        data_cache: Optional[GeneratedDataCache] = None,
     ):
         self.problem: RepositoryProblem = problem
         self.program = program
         self.submission_logger = submission_logger
+        # In MiB, compared against the peak resident set size of the submission
+        self.memory_limit = memory_limit
+        self.data_cache = data_cache
+        self.run = run
 
         self.time_limit = problem.limits.time_factor  # TODO Fix with base time
 
@@ -261,13 +425,14 @@ class FuzzingRun(object):
             raise ValueError(f"Incompatible seed file structure {self.case_seed_file}")
         original_seed = FuzzingRun.get_seed(self.case_seed_file, self.seed_type)
         seed_bits = math.floor(math.log(abs(original_seed), 2))
-        self.seed = str(abs(random.getrandbits(seed_bits)))
+        self.seed = str(random.Random(run_seed).getrandbits(seed_bits))
 
         file_directory = fuzzing_directory / "data"
         file_directory.mkdir(exist_ok=True)
         self.seed_file: Path = file_directory / f"{self.seed}.seed"
         self.input_file: Path = file_directory / f"{self.seed}.in"
         self.answer_file: Path = file_directory / f"{self.seed}.ans"
+        self.usage_report_file: Path = file_directory / f"{self.seed}.usage"
 
         self.args = verifyproblem.default_args()
         self.args.bail_on_error = False
@@ -277,29 +442,139 @@ class FuzzingRun(object):
         self.args.use_result_cache = False
 
         self.test_data = TestCaseGroup(problem.kattis_problem, fuzzing_directory)
+        # Answers of the individual cases of the generated input, if they can be split
+        self.case_answers: Optional[List[List[str]]] = None
+
+        self.usage: Dict[str, ResourceUsage] = {
+            "submission": ResourceUsage(),
+            "input": ResourceUsage(),
+            "answer": ResourceUsage(),
+        }
+        self.last_submission_usage = ResourceUsage()
+        # Set if the generated data was taken from the cache
+        self.cached = False
 
-    def _write_case(self, case: List[str]):
-        with self.input_file.open(mode="wt", encoding="utf-8") as f:
-            for line in case:
+    @staticmethod
+    def _write_lines(file: Path, lines: List[str]):
+        with file.open(mode="wt", encoding="utf-8") as f:
+            for line in lines:
                 f.write(line)
                 f.write("\n")
 
+    def _generate_input(self):
+        with accounting.measure(self.usage["input"]):
+            self.problem.generate_input_if_required(self.seed_file, self.input_file)
+
+    def _generate_answer(self):
+        with accounting.measure(self.usage["answer"]):
+            self.problem.generate_answer_if_required(self.input_file, self.answer_file)
+
+    def _generate_data(self):
+        if self.data_cache is None:
+            self._generate_input()
+            self._generate_answer()
+            return
+
+        directory = self.problem.directory.absolute()
+        with self.seed_file.open(mode="rt") as f:
+            key = (
+                str(directory),
+                GeneratedDataCache.source_version(directory),
+                f.read(),
+            )
+        cached = self.data_cache.get(key)
+        if cached is not None:
+            self.submission_logger.debug("Reusing generated data of seed %s", self.seed)
+            self.input_file.write_text(cached.input)
+            self.answer_file.write_text(cached.answer)
+            self.cached = True
+            return
+
+        self._generate_input()
+        self._generate_answer()
+        self.data_cache.put(
+            key,
+            GeneratedData(self.input_file.read_text(), self.answer_file.read_text()),
+        )
+
+    def _exceeds_memory_limit(self) -> bool:
+        return (
+            self.memory_limit is not None
+            and self.last_submission_usage.peak_memory > self.memory_limit * 1024
+        )
+
+    def _cache_answers(self):
+        with self.input_file.open(mode="rt") as f:
+            cases = int(f.readline())
+        self.case_answers = ProblemLayout.split_answers(self.answer_file, cases)
+        if self.case_answers is None:
+            logger.debug("Could not split answer into cases, not caching answers")
+
+    def _write_case(self, case: List[str], case_numbers: List[int]):
+        FuzzingRun._write_lines(self.input_file, case)
+        if self.case_answers is None:
+            self._generate_answer()
+        else:
+            FuzzingRun._write_lines(
+                self.answer_file,
+                ProblemLayout.assemble_answer(self.case_answers, case_numbers),
+            )
+
     def _run_submission(
         self,
     ) -> Tuple[SubmissionResult, SubmissionResult, SubmissionResult]:
         time_limit_high = self.time_limit * 2
-        self.problem.generate_answer_if_required(self.input_file, self.answer_file)
-        return TestCase(
+        self.last_submission_usage = ResourceUsage()
+        results = TestCase(
             self.problem.kattis_problem,
             str(self.input_file.with_suffix("")),
             self.test_data,
         ).run_submission(
-            self.program,
+            _MeasuredProgram(
+                self.program, self.last_submission_usage, self.usage_report_file
+            ),
             self.args,
             self.time_limit,
             int(self.time_limit + 1),
             int(time_limit_high),
         )
+        self.usage["submission"].add(self.last_submission_usage)
+        return results
+
+    def _bisect(
+        self, name: str, failing: Callable[[SubmissionResult], bool]
+    ) -> SubmissionResult:
+        """Binary search for a single case of the current input on which the
+        submission is still failing, returns the result on that case."""
+        layout = ProblemLayout(self.input_file)
+        first_half, second_half = layout.split_case(self.input_file)
+        cases = int(first_half[0]) + int(second_half[0])
+        case_numbers = list(range(1, cases + 1))
+
+        while first_half[0] != "0":
+            half = len(case_numbers) // 2
+            first_numbers = case_numbers[:half]
+            second_numbers = case_numbers[half:]
+            self._write_case(first_half, first_numbers)
+
+            self.submission_logger.debug("Running program again on half of remainder")
+            result, _, _ = self._run_submission()
+            if failing(result):
+                self.submission_logger.debug("%s occurred in first half", name)
+                case_numbers = first_numbers
+            else:
+                self.submission_logger.debug("%s occurred in second half", name)
+                self._write_case(second_half, second_numbers)
+                case_numbers = second_numbers
+
+            first_half, second_half = layout.split_case(self.input_file)
+
+        self.submission_logger.debug("Should have %s case now", name)
+        self._write_case(second_half, case_numbers)
+
+        self.submission_logger.debug("Running program on %s case", name)
+        result, _, _ = self._run_submission()
+        return result
 
     def __enter__(self):
         return self
@@ -309,7 +584,8 @@ class FuzzingRun(object):
             FuzzingRun.randomize_multiple(
                 self.case_seed_file, self.seed_file, FuzzingRun.RANDOM_RUNS, self.seed
             )
-            self.problem.generate_input_if_required(self.seed_file, self.input_file)
+            self._generate_data()
+            self._cache_answers()
 
             result, _, _ = self._run_submission()
             logger.debug("Received initial feedback %s", result)
@@ -329,12 +605,9 @@ class FuzzingRun(object):
 
                 layout = ProblemLayout(self.input_file)
                 picked_case = layout.pick_case(self.input_file, failing_case)
-                self._write_case(picked_case)
+                self._write_case(picked_case, [failing_case])
 
                 self.submission_logger.debug("Running program again on singular case")
-                self.problem.generate_answer_if_required(
-                    self.input_file, self.answer_file
-                )
                 result, _, _ = self._run_submission()
 
                 run_feedback = FuzzingRun.parse_feedback(result)
@@ -348,49 +621,32 @@ class FuzzingRun(object):
                 self.submission_logger.debug(
                     "Runtime error occurred, binary search for the test case"
                 )
-
-                layout = ProblemLayout(self.input_file)
-                first_half, second_half = layout.split_case(self.input_file)
-
-                while first_half[0] != "0":
-                    self._write_case(first_half)
-
-                    self.submission_logger.debug(
-                        "Running program again on half of remainder"
-                    )
-                    self.problem.generate_answer_if_required(
-                        self.input_file, self.answer_file
-                    )
-                    result, _, _ = self._run_submission()
-                    if result.verdict == "RTE":
-                        self.submission_logger.debug("RTE occurred in first half")
-                    else:
-                        self.submission_logger.debug("RTE occurred in second half")
-                        self._write_case(second_half)
-
-                    first_half, second_half = layout.split_case(self.input_file)
-
-                self.submission_logger.debug("Should have RTE case now")
-                self._write_case(second_half)
-
-                self.submission_logger.debug("Running program on RTE case")
-                self.problem.generate_answer_if_required(
-                    self.input_file, self.answer_file
-                )
-                result, _, _ = self._run_submission()
+                result = self._bisect("RTE", lambda r: r.verdict == "RTE")
 
                 run_feedback = FuzzingRun.parse_feedback(result)
                 if result.verdict == "RTE":
                     run_verdict = RunVerdict.RUNTIME_EXCEPTION
                 else:
                     run_verdict = RunVerdict.FEEDBACK_INCONSISTENCY
+            elif self._exceeds_memory_limit():
+                logger.debug("Search for MLE case")
+                self.submission_logger.debug(
+                    "Memory limit exceeded, binary search for the test case"
+                )
+                result = self._bisect("MLE", lambda _: self._exceeds_memory_limit())
+
+                run_feedback = FuzzingRun.parse_feedback(result)
+                if self._exceeds_memory_limit():
+                    run_verdict = RunVerdict.MEMORY_LIMIT_EXCEEDED
+                else:
+                    run_verdict = RunVerdict.FEEDBACK_INCONSISTENCY
             else:
                 run_feedback = FuzzingRun.parse_feedback(result)
                 run_verdict = RunVerdict.get(result.verdict)
 
         elif self.seed_type == SeedStructure.SINGLE_CASE:
             FuzzingRun.randomize_single(self.case_seed_file, self.seed_file, self.seed)
-            self.problem.generate_input_if_required(self.seed_file, self.input_file)
+            self._generate_data()
 
             result, _, _ = self._run_submission()
             logger.debug("Received feedback %s", result)
@@ -399,12 +655,16 @@ class FuzzingRun(object):
                 raise ValueError("No executions")
 
             run_feedback = FuzzingRun.parse_feedback(result)
-            run_verdict = RunVerdict.get(result.verdict)
+            if result.verdict not in ("WA", "RTE") and self._exceeds_memory_limit():
+                run_verdict = RunVerdict.MEMORY_LIMIT_EXCEEDED
+            else:
+                run_verdict = RunVerdict.get(result.verdict)
         else:
             raise AssertionError
 
         logger.debug(
-            "Finished run on %s (with seed %s) with verdict %s",
+            "Finished run %d on %s (with seed %s) with verdict %s",
+            self.run,
             self.case_seed_file.name,
             self.seed,
             run_verdict,
@@ -416,10 +676,18 @@ class FuzzingRun(object):
             self.answer_file,
             run_verdict,
             run_feedback,
+            self.usage,
+            self.run,
+            self.cached,
         )
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        for file in [self.input_file, self.seed_file, self.answer_file]:
+        for file in [
+            self.input_file,
+            self.seed_file,
+            self.answer_file,
+            self.usage_report_file,
+        ]:
             try:
                 file.unlink(missing_ok=True)
             except IOError as e:
@@ -437,11 +705,26 @@ class FuzzingRequest(object):
     logger: logging.Logger
 
     run_count: int = 10
+    # Job seed from which the seed of every run is derived, random if not given
+    seed: Optional[int] = None
+    # Index of the first run, to replay single runs of a job
+    first_run: int = 0
+    # Optional memory limit in MiB, exceeding it is reported as MLE
+    memory_limit: Optional[int] = None
+    # Entered around every single run, e.g. to wait for a slot of a shared worker pool
+    run_slot: Callable[[], ContextManager] = contextlib.nullcontext
+    # Entered around compilation, e.g. to limit the number of concurrent compilations
+    compile_slot: Callable[[], ContextManager] = contextlib.nullcontext
 
 
 @dataclasses.dataclass
 class FuzzingResult(object):
     run_results: Collection[RunResult]
+    # Resources used over all runs, including the correct ones
+    usage: Dict[str, ResourceUsage]
+    seed: int
+    # Number of runs which took their generated data from the cache
+    cached_runs: int = 0
 
 
 class Fuzzer(object):
@@ -449,6 +732,55 @@ class Fuzzer(object):
 
     def __init__(self):
         self.language_config = languages.load_language_config()
+        self.data_cache = GeneratedDataCache()
+
+    @staticmethod
+    def random_seed() -> int:
+        return secrets.randbits(63)
+
+    @staticmethod
+    def derive_seed(seed: int, run: int) -> int:
+        digest = hashlib.sha256(f"{seed}:{run}".encode("ascii")).digest()
+        return int.from_bytes(digest[:8], byteorder="big")
+
+    @staticmethod
+    def _write_sources(sources: Dict[str, str], source_directory: Path):
+        root = source_directory.resolve()
+        for name, source_code in sources.items():
+            source_file = (source_directory / name).resolve()
+            if source_file == root or root not in source_file.parents:
+                raise ValueError(f"Invalid source file name {name}")
+            source_file.parent.mkdir(parents=True, exist_ok=True)
+            with source_file.open(mode="wt") as source:
+                source.write(source_code)
+
+    def _compile(
+        self, request: FuzzingRequest, source_directory: Path, compile_directory: Path
+    ) -> Program:
+        language = self.language_config.languages.get(request.language, None)
+        if language is None:
+            source_files = [
+                str(path) for path in source_directory.rglob("*") if path.is_file()
+            ]
+            language = self.language_config.detect_language(source_files)
+            if language is None:
+                raise ValueError("Could not detect language of submission")
+
+        request.logger.info(
+            "Using language %s for %d source files", language.name, len(request.sources)
+        )
+        program = SourceCode(
+            str(source_directory),
+            language=language,
+            work_dir=str(compile_directory),
+        )
+
+        with request.compile_slot():
+            request.logger.info("Compiling program")
+            (compilation_result, error) = program.compile()
+        if not compilation_result:
+            raise ValueError(f"Compile error for program {program.name}: {error}")
+        return program
 
     def run(self, request: FuzzingRequest) -> Optional[FuzzingResult]:
         fuzzing_directory = None
@@ -470,50 +802,41 @@ class Fuzzer(object):
                 ]:
                     d.mkdir(parents=True, exist_ok=True)
 
-                for name, source_code in request.sources.items():
-                    source_file = source_directory / name
-                    with source_file.open(mode="wt") as source:
-                        source.write(source_code)
-
-                    language = self.language_config.languages.get(
-                        request.language, None
-                    )
-                    if language is None:
-                        source_files = [
-                            str(path) for path in source_directory.iterdir()
-                        ]
-                        language = self.language_config.detect_language(source_files)
-
-                    request.logger.info("Using language %s", language.name)
-                    program = SourceCode(
-                        str(source_directory),
-                        language=language,
-                        work_dir=str(compile_directory),
-                    )
-
-                    request.logger.info("Compiling program")
-                    (compilation_result, error) = program.compile()
-                    if not compilation_result:
-                        raise ValueError(
-                            f"Compile error for program {program.name}: {error}"
-                        )
+                Fuzzer._write_sources(request.sources, source_directory)
+                program = self._compile(request, source_directory, compile_directory)
 
-                    run_results = []
+                run_results = []
+                usage: Dict[str, ResourceUsage] = defaultdict(ResourceUsage)
+                cached_runs = 0
 
-                    request.logger.info("Setting up problem")
+                request.logger.info("Setting up problem")
 
-                    with request.problem as _:
-                        request.logger.info("Starting randomization")
-                        fails = 0
-                        for i in range(request.run_count):
+                seed = request.seed
+                if seed is None:
+                    seed = Fuzzer.random_seed()
+
+                with request.problem as _:
+                    request.logger.info("Starting randomization with seed %d", seed)
+                    fails = 0
+                    for i in range(request.run_count):
+                        run_index = request.first_run + i
+                        with request.run_slot():
                             with FuzzingRun(
                                 request.problem,
                                 program,
                                 request.logger,
                                 request.seed_file,
                                 fuzzing_directory,
+                                run_index,
+                                Fuzzer.derive_seed(seed, run_index),
+                                request.memory_limit,
+                                self.data_cache,
                             ) as run:
                                 run_result = run.evaluate()
+                                for key, run_usage in run_result.usage.items():
+                                    usage[key].add(run_usage)
+                                if run_result.cached:
+                                    cached_runs += 1
                                 if (
                                     run_result.verdict
                                     == RunVerdict.FEEDBACK_INCONSISTENCY
@@ -526,20 +849,20 @@ class Fuzzer(object):
                                     fails += 1
                                     run_results.append(run_result)
 
-                            request.logger.info(
-                                "Finished %d runs of %d (%d failed)",
-                                i + 1,
-                                request.run_count,
-                                fails,
-                            )
-                            if fails >= Fuzzer.MAX_FAILS:
-                                request.logger.info("Enough runs failed, ending run")
-                                break
+                        request.logger.info(
+                            "Finished %d runs of %d (%d failed)",
+                            i + 1,
+                            request.run_count,
+                            fails,
+                        )
+                        if fails >= Fuzzer.MAX_FAILS:
+                            request.logger.info("Enough runs failed, ending run")
+                            break
 
-                        request.logger.info("Fuzzing finished")
-                        logger.info("Finished fuzzing")
+                    request.logger.info("Fuzzing finished")
+                    logger.info("Finished fuzzing")
 
-                        return FuzzingResult(run_results)
+                    return FuzzingResult(run_results, dict(usage), seed, cached_runs)
         except ExecutionError as e:
             logger.warning("Execution failed with error:\n%s", e.err)
             request.logger.error("Execution failed")
@@ -0,0 +1,45 @@
+"""Runs a command and writes its resource usage to a report file.
+
+Usage: measure_helper.py <report> <command> [<argument> ...]
+
+The command is started from this small process rather than from the server,
+since Linux accounts the pre-exec memory of a forked process to its peak
+resident set size. Only the standard library modules loaded at startup are
+used to keep that footprint small. The exit status of the command is passed
+on, including termination by a signal.
+"""
+
+import os
+import resource
+import signal
+import sys
+
+
+def main():
+    report, *argv = sys.argv[1:]
+    pid = os.fork()
+    if pid == 0:
+        try:
+            # The interpreter ignores these signals, which would be inherited
+            for name in ("SIGPIPE", "SIGXFSZ"):
+                if hasattr(signal, name):
+                    signal.signal(getattr(signal, name), signal.SIG_DFL)
+            os.execvp(argv[0], argv)
+        finally:
+            os._exit(127)
+
+    _, status, rusage = os.wait4(pid, 0)
+    with open(report, mode="wt") as f:
+        f.write(f"{rusage.ru_utime} {rusage.ru_stime} {rusage.ru_maxrss}\n")
+
+    if os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        if sig not in (signal.SIGKILL, signal.SIGSTOP):
+            signal.signal(sig, signal.SIG_DFL)
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        os.kill(os.getpid(), sig)
+    os._exit(os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1)
+
+
+if __name__ == "__main__":
+    main()
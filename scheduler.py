@@ -0,0 +1,170 @@
+import contextlib
+import logging
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QueueKey = Tuple[str, str]
+
+
+class RunReservation(object):
+    def __init__(
+        self, scheduler: "FairShareScheduler", client: str, problem: str, runs: int
+    ):
+        self.scheduler = scheduler
+        self.client = client
+        self.problem = problem
+        self.remaining = runs
+        self.closed = False
+
+    @contextlib.contextmanager
+    def slot(self):
+        if self.closed or self.remaining <= 0:
+            raise ValueError(f"Run budget of reservation for {self.client} exhausted")
+        self.scheduler._acquire(self.client, self.problem)
+        try:
+            yield
+        finally:
+            self.remaining -= 1
+            self.scheduler._release(self.client, self.problem)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.scheduler._return_budget(self.client, self.problem, self.remaining)
+        self.remaining = 0
+
+
+class FairShareScheduler(object):
+    """Weighted fair-share scheduling of single fuzzing runs on a shared pool.
+
+    Each client accumulates virtual time proportional to the runs it executed
+    divided by its weight. Whenever a worker becomes free, the waiting client
+    with the least virtual time is served, so runs of different jobs are
+    interleaved and small jobs are not stuck behind large ones. Within a
+    client, the problems it fuzzes share its runs equally the same way, so a
+    large job on one problem does not hold back the client's other problems.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        weights: Optional[Dict[str, float]] = None,
+        default_weight: float = 1.0,
+        client_budget: Optional[int] = None,
+    ):
+        if workers < 1:
+            raise ValueError(f"Need at least one worker, got {workers}")
+        self.workers = workers
+        self.weights = dict(weights or {})
+        self.default_weight = default_weight
+        self.client_budget = client_budget
+
+        self._condition = threading.Condition()
+        self._running = 0
+        self._waiting: Dict[QueueKey, Deque[object]] = defaultdict(deque)
+        self._virtual_time: Dict[str, float] = {}
+        self._problem_time: Dict[QueueKey, float] = {}
+        self._reserved: Dict[str, int] = defaultdict(int)
+        self._problem_reserved: Dict[QueueKey, int] = defaultdict(int)
+
+    def weight(self, client: str) -> float:
+        return self.weights.get(client, self.default_weight)
+
+    def reserve(self, client: str, problem: str, runs: int) -> Optional[RunReservation]:
+        with self._condition:
+            reserved = self._reserved.get(client, 0)
+            if self.client_budget is not None and reserved + runs > self.client_budget:
+                logger.info(
+                    "Client %s exceeded run budget (%d reserved, %d requested)",
+                    client,
+                    reserved,
+                    runs,
+                )
+                return None
+            self._reserved[client] = reserved + runs
+            self._problem_reserved[(client, problem)] += runs
+        return RunReservation(self, client, problem, runs)
+
+    def reserved(self, client: str) -> int:
+        with self._condition:
+            return self._reserved.get(client, 0)
+
+    def _return_budget(self, client: str, problem: str, runs: int):
+        with self._condition:
+            self._consume(client, problem, runs)
+
+    def _consume(self, client: str, problem: str, runs: int):
+        key = (client, problem)
+        self._reserved[client] -= runs
+        if self._reserved[client] <= 0:
+            del self._reserved[client]
+        self._problem_reserved[key] -= runs
+        if self._problem_reserved[key] <= 0:
+            del self._problem_reserved[key]
+        if key not in self._waiting and key not in self._problem_reserved:
+            # Nothing left to do for the problem, forget its history
+            self._problem_time.pop(key, None)
+        if client not in self._reserved and not any(
+            waiting == client for waiting, _ in self._waiting
+        ):
+            # Client has nothing left to do, forget its history
+            self._virtual_time.pop(client, None)
+
+    def _next_queue(self) -> Optional[QueueKey]:
+        candidates = [key for key, queue in self._waiting.items() if queue]
+        if not candidates:
+            return None
+        client = min(
+            {client for client, _ in candidates},
+            key=lambda client: self._virtual_time[client],
+        )
+        return min(
+            (key for key in candidates if key[0] == client),
+            key=lambda key: self._problem_time[key],
+        )
+
+    def _acquire(self, client: str, problem: str):
+        key = (client, problem)
+        ticket = object()
+        with self._condition:
+            if client not in self._virtual_time:
+                # Newly active clients start at the current minimum and do not
+                # get credit for the time they were idle
+                self._virtual_time[client] = min(
+                    self._virtual_time.values(), default=0.0
+                )
+            if key not in self._problem_time:
+                # Same for problems newly active within the client
+                self._problem_time[key] = min(
+                    (
+                        time
+                        for (other, _), time in self._problem_time.items()
+                        if other == client
+                    ),
+                    default=0.0,
+                )
+            queue = self._waiting[key]
+            queue.append(ticket)
+            while not (
+                self._running < self.workers
+                and self._next_queue() == key
+                and queue[0] is ticket
+            ):
+                self._condition.wait()
+            queue.popleft()
+            if not queue:
+                del self._waiting[key]
+            self._running += 1
+            self._virtual_time[client] += 1.0 / self.weight(client)
+            self._problem_time[key] += 1.0
+            self._condition.notify_all()
+
+    def _release(self, client: str, problem: str):
+        with self._condition:
+            self._running -= 1
+            self._consume(client, problem, 1)
+            self._condition.notify_all()
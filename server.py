@@ -4,14 +4,18 @@ import sys
 import threading
 import uuid
 import argparse
+import contextlib
+import os
 from io import StringIO
-from typing import List, Dict
+from typing import Callable, ContextManager, List, Dict, Optional
 
 from flask import Flask, jsonify, request, url_for, redirect
 from flask_inputs import Inputs
 from flask_inputs.validators import JsonSchema
 
 from fuzzer import FuzzingRequest, Fuzzer
+from scheduler import FairShareScheduler, RunReservation
+from status import StatusBoard
 
 from pydomjudge.repository.kattis import RepositoryProblem, Repository
 
@@ -40,6 +44,9 @@ schema = {
         },
         "case_name": {"type": "string"},
         "runs": {"type": "integer", "minimum": 0},
+        "memory_limit": {"type": "integer", "minimum": 16},
+        "seed": {"type": "integer", "minimum": 0},
+        "first_run": {"type": "integer", "minimum": 0},
     },
     "required": ["problem", "language", "sources", "case_name"],
 }
@@ -52,15 +59,44 @@ class JsonInputs(Inputs):
 class FuzzingThread(threading.Thread):
     FORMATTER = logging.Formatter("%(message)s")
 
-    def __init__(self, fuzzer_id, submission, repository):
+    def __init__(
+        self,
+        fuzzer_id,
+        submission,
+        repository,
+        reservation: RunReservation,
+        board: StatusBoard,
+        compile_slot: Callable[[], ContextManager],
+    ):
         threading.Thread.__init__(self)
 
         self.fuzzer_id = fuzzer_id
         self.submission = submission
         self.submission["valid"] = True
-        self.state = {"id": self.fuzzer_id, "finished": False}
         self.repository = repository
+        self.reservation = reservation
+        self.board = board
+        self.compile_slot = compile_slot
         self.log_stream = StringIO()
+        self.runs_finished = 0
+
+        self.board.register(
+            self.fuzzer_id,
+            client=reservation.client,
+            problem=submission["problem"],
+            case_name=submission["case_name"],
+            runs=reservation.remaining,
+            seed=submission["seed"],
+            runs_finished=0,
+            finished=False,
+        )
+
+    @contextlib.contextmanager
+    def run_slot(self):
+        with self.reservation.slot():
+            yield
+        self.runs_finished += 1
+        self.board.publish(self.fuzzer_id, runs_finished=self.runs_finished)
 
     def run(self):
         submission_logger = logging.getLogger(f"submission.{self.fuzzer_id}")
@@ -85,7 +121,12 @@ class FuzzingThread(threading.Thread):
                 problem=problem,
                 seed_file=seed_file,
                 logger=submission_logger,
-                run_count=self.submission.get("runs", 10),
+                run_count=self.reservation.remaining,
+                memory_limit=self.submission.get("memory_limit"),
+                seed=self.submission["seed"],
+                first_run=self.submission.get("first_run", 0),
+                run_slot=self.run_slot,
+                compile_slot=self.compile_slot,
             )
             result = fuzzer.run(request)
             if result is not None:
@@ -94,38 +135,112 @@ class FuzzingThread(threading.Thread):
                     cases[f"{index + 1}_{run_result.verdict}"] = {
                         "case.in": run_result.input,
                         "case.ans": run_result.answer,
+                        "run": run_result.run,
+                        "cached": run_result.cached,
+                        "usage": {
+                            key: usage.to_dict()
+                            for key, usage in run_result.usage.items()
+                        },
                     }
-                self.state["cases"] = cases
-                self.state["log"] = self.log_stream.getvalue()
+                usage = {key: usage.to_dict() for key, usage in result.usage.items()}
+                self.board.publish(
+                    self.fuzzer_id,
+                    cases=cases,
+                    usage=usage,
+                    cached_runs=result.cached_runs,
+                )
             logging.info("Finished fuzzing run %s", self.fuzzer_id)
         except Exception as e:
             logging.warning("Unexpected error", exc_info=e)
             submission_logger.error("Unexpected error: %s", e)
         finally:
+            self.reservation.close()
             submission_log_handler.flush()
+            self.board.publish(
+                self.fuzzer_id, log=self.log_stream.getvalue(), finished=True
+            )
             self.log_stream.close()
-            self.state["finished"] = True
 
     def get_state(self):
-        state = self.state.copy()
-        if not state["finished"]:
-            state["log"] = self.log_stream.getvalue()
-        return state
+        state = self.board.get(self.fuzzer_id)
+        if state is None or state["finished"]:
+            return state
+        try:
+            return {**state, "log": self.log_stream.getvalue()}
+        except ValueError:
+            # Finished in the meantime and closed the log
+            return self.board.get(self.fuzzer_id)
 
 
 class FuzzingManager(object):
-    def __init__(self, repository: "Repository"):
+    DEFAULT_RUNS = 10
+
+    def __init__(
+        self,
+        repository: "Repository",
+        scheduler: FairShareScheduler,
+        max_runs: Optional[int] = None,
+        compile_workers: int = 1,
+    ):
+        if compile_workers < 1:
+            raise ValueError(f"Need at least one compile worker, got {compile_workers}")
+        self.board = StatusBoard()
         self.repository = repository
+        self.scheduler = scheduler
+        self.max_runs = max_runs
+        self.compile_semaphore = threading.BoundedSemaphore(compile_workers)
         self.state: Dict[str, FuzzingThread] = {}
-        pass
 
-    def run(self, submission):
+    @contextlib.contextmanager
+    def compile_slot(self):
+        with self.compile_semaphore:
+            yield
+
+    def run(self, submission, client: str) -> Optional[str]:
+        runs = submission.get("runs", FuzzingManager.DEFAULT_RUNS)
+        if self.max_runs is not None and runs > self.max_runs:
+            raise ValueError(f"At most {self.max_runs} runs are allowed")
+        reservation = self.scheduler.reserve(client, submission["problem"], runs)
+        if reservation is None:
+            return None
+
+        if "seed" not in submission:
+            submission["seed"] = Fuzzer.random_seed()
+
         fuzzing_id = str(uuid.uuid4())
-        thread = FuzzingThread(fuzzing_id, submission, self.repository)
+        thread = FuzzingThread(
+            fuzzing_id,
+            submission,
+            self.repository,
+            reservation,
+            self.board,
+            self.compile_slot,
+        )
         self.state[fuzzing_id] = thread
         thread.start()
         return fuzzing_id
 
+    def stop(self, fuzzing_id) -> Optional[FuzzingThread]:
+        thread = self.state.pop(fuzzing_id, None)
+        if thread is not None:
+            self.board.remove(fuzzing_id)
+        return thread
+
+
+def request_client() -> str:
+    """Identifies the client of the current request for scheduling and budgets.
+
+    This is the peer address, unless a trusted header set by a reverse proxy is
+    configured. For a list like X-Forwarded-For the last entry is used, which is
+    the one appended by the proxy itself and thus cannot be forged by clients.
+    """
+    header = app.config.get("CLIENT_HEADER")
+    if header:
+        value = request.headers.get(header, "").split(",")[-1].strip()
+        if value:
+            return value
+    return request.remote_addr
+
 
 @app.route("/")
 def home():
@@ -150,8 +265,12 @@ def get_problem_seeds(problem_name):
 
 @app.route("/status")
 def show_status():
-    status = {k: v.get_state() for k, v in manager.state.items()}
-    return jsonify(success=True, status=status)
+    try:
+        after, limit, filters = StatusBoard.parse_query(request.args)
+        status, cursor = manager.board.page(after, limit, filters)
+    except ValueError as e:
+        return jsonify(success=False, errors=[str(e)])
+    return jsonify(success=True, status=status, next=cursor)
 
 
 @app.route("/submission", methods=["POST"])
@@ -161,8 +280,14 @@ def start_fuzzing():
         app.logger.debug("Invalid JSON request: %s", request)
         return jsonify(success=False, errors=inputs.errors)
 
-    fuzzing_id = manager.run(submission=request.get_json())
-    return jsonify(success=True, id=fuzzing_id)
+    submission = request.get_json()
+    try:
+        fuzzing_id = manager.run(submission=submission, client=request_client())
+    except ValueError as e:
+        return jsonify(success=False, errors=[str(e)])
+    if fuzzing_id is None:
+        return jsonify(success=False, errors=["Run budget exceeded, try again later"])
+    return jsonify(success=True, id=fuzzing_id, seed=submission["seed"])
 
 
 @app.route("/submission/<fuzzing_id>", methods=["GET"])
@@ -174,12 +299,13 @@ def show_single_status(fuzzing_id):
 
 @app.route("/submission/<fuzzing_id>", methods=["DELETE"])
 def stop_fuzzing(fuzzing_id):
-    fuzzer = manager.state.pop(fuzzing_id, None)
+    fuzzer = manager.state.get(fuzzing_id)
 
     if fuzzer is None:
         return jsonify(success=False, state=None)
 
     fuzzer_state = fuzzer.get_state()
+    manager.stop(fuzzing_id)
     return jsonify(success=True, state=fuzzer_state)
 
 
@@ -192,6 +318,50 @@ if __name__ == "__main__":
         type=pathlib.Path,
         required=True,
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of fuzzing runs executed in parallel across all jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    parser.add_argument(
+        "--compile-workers",
+        help="Number of submissions compiled in parallel, independent of the runs",
+        type=int,
+        default=max(1, (os.cpu_count() or 1) // 2),
+    )
+    parser.add_argument(
+        "--max-runs",
+        help="Maximum number of runs a single job may request",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "--client-budget",
+        help="Maximum number of runs a single client may have pending",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--weight",
+        help="Scheduling weight of a client, given as <client>=<weight>",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--client-header",
+        help="Header identifying the client, e.g. X-Forwarded-For, only set this "
+        "behind a reverse proxy which sets the header",
+        default=None,
+    )
+    parser.add_argument(
+        "--asgi",
+        help="Serve through uvicorn with non-blocking status requests",
+        action="store_true",
+    )
+    parser.add_argument("--host", help="Address to listen on", default="127.0.0.1")
+    parser.add_argument("--port", help="Port to listen on", type=int, default=5000)
     args = parser.parse_args()
     repository_path: pathlib.Path = args.repository
 
@@ -218,6 +388,33 @@ if __name__ == "__main__":
 
     logging.getLogger().info("Found %d problems with seeds", len(problems))
 
+    weights = {}
+    for weight in args.weight:
+        client, _, value = weight.rpartition("=")
+        try:
+            weights[client] = float(value)
+        except ValueError:
+            sys.exit(f"Invalid weight {weight}")
+        if not client or weights[client] <= 0:
+            sys.exit(f"Invalid weight {weight}")
+
+    app.config["CLIENT_HEADER"] = args.client_header
     fuzzer = Fuzzer()
-    manager = FuzzingManager(repository)
-    app.run()
+    manager = FuzzingManager(
+        repository,
+        FairShareScheduler(
+            args.workers, weights=weights, client_budget=args.client_budget
+        ),
+        max_runs=args.max_runs,
+        compile_workers=args.compile_workers,
+    )
+    if args.asgi:
+        import uvicorn
+
+        from asgi import StatusApplication
+
+        uvicorn.run(
+            StatusApplication(app, manager.board), host=args.host, port=args.port
+        )
+    else:
+        app.run(host=args.host, port=args.port)
@@ -0,0 +1,190 @@
+import bisect
+import itertools
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Snapshot = Dict[str, Any]
+IndexKey = Tuple[Tuple[str, Any], ...]
+
+
+class _SortedIndex(object):
+    """Job ids ordered by the sequence number of their registration."""
+
+    def __init__(self):
+        self._sequences: List[int] = []
+        self._jobs: Dict[int, str] = {}
+
+    def __len__(self):
+        return len(self._sequences)
+
+    def add(self, sequence: int, job_id: str):
+        bisect.insort(self._sequences, sequence)
+        self._jobs[sequence] = job_id
+
+    def remove(self, sequence: int):
+        del self._sequences[bisect.bisect_left(self._sequences, sequence)]
+        del self._jobs[sequence]
+
+    def iterate(self, after: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """Iterates the jobs registered after the given sequence number, which
+        does not need to be in the index (anymore)."""
+        start = 0 if after is None else bisect.bisect_right(self._sequences, after)
+        for position in range(start, len(self._sequences)):
+            sequence = self._sequences[position]
+            yield sequence, self._jobs[sequence]
+
+
+class StatusBoard(object):
+    """Precomputed, immutable snapshots of the state of every fuzzing job.
+
+    Jobs publish their state changes to the board, which replaces the job's
+    snapshot and notifies subscribers. Readers only ever see complete
+    snapshots and never touch the fuzzing threads. Jobs are additionally
+    indexed by every combination of the filterable keys in registration order.
+    Pages continue after the registration sequence number of the last job of
+    the previous page, so a page only visits the jobs it returns and cursors
+    stay valid when jobs change or are removed.
+    """
+
+    FILTER_KEYS = ("finished", "client", "problem")
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 500
+
+    @staticmethod
+    def parse_query(
+        args: Mapping[str, str],
+    ) -> Tuple[Optional[int], int, Dict[str, Any]]:
+        try:
+            after = int(args["after"]) if args.get("after") else None
+        except ValueError:
+            raise ValueError("after has to be an integer")
+        try:
+            limit = int(args.get("limit", StatusBoard.DEFAULT_LIMIT))
+        except ValueError:
+            raise ValueError("limit has to be an integer")
+        if not 0 < limit <= StatusBoard.MAX_LIMIT:
+            raise ValueError(f"limit has to be between 1 and {StatusBoard.MAX_LIMIT}")
+
+        filters = {}
+        for key in StatusBoard.FILTER_KEYS:
+            if key not in args:
+                continue
+            value = args[key]
+            if key == "finished":
+                if value not in ("true", "false"):
+                    raise ValueError("finished has to be true or false")
+                filters[key] = value == "true"
+            else:
+                filters[key] = value
+        return after, limit, filters
+
+    @staticmethod
+    def _index_keys(snapshot: Snapshot) -> List[IndexKey]:
+        present = [key for key in StatusBoard.FILTER_KEYS if key in snapshot]
+        return [
+            tuple((key, snapshot[key]) for key in combination)
+            for size in range(len(present) + 1)
+            for combination in itertools.combinations(present, size)
+        ]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Snapshot] = {}
+        self._index: Dict[IndexKey, _SortedIndex] = {}
+        self._sequences: Dict[str, int] = {}
+        self._next_sequence = 0
+        self._listeners: List[Callable[[Snapshot], None]] = []
+
+    def subscribe(self, listener: Callable[[Snapshot], None]):
+        with self._lock:
+            self._listeners = self._listeners + [listener]
+
+    def unsubscribe(self, listener: Callable[[Snapshot], None]):
+        with self._lock:
+            self._listeners = [
+                existing for existing in self._listeners if existing is not listener
+            ]
+
+    def _update_index(
+        self, job_id: str, old: Optional[Snapshot], new: Optional[Snapshot]
+    ):
+        sequence = self._sequences[job_id]
+        old_keys = [] if old is None else StatusBoard._index_keys(old)
+        new_keys = [] if new is None else StatusBoard._index_keys(new)
+        for key in old_keys:
+            if key in new_keys:
+                continue
+            index = self._index[key]
+            index.remove(sequence)
+            if not len(index):
+                del self._index[key]
+        for key in new_keys:
+            if key not in old_keys:
+                self._index.setdefault(key, _SortedIndex()).add(sequence, job_id)
+
+    def register(self, job_id: str, **state):
+        with self._lock:
+            if job_id in self._jobs:
+                raise ValueError(f"Job {job_id} is already registered")
+            snapshot = {"id": job_id, **state}
+            self._jobs[job_id] = snapshot
+            self._sequences[job_id] = self._next_sequence
+            self._next_sequence += 1
+            self._update_index(job_id, None, snapshot)
+            listeners = self._listeners
+        self._notify(listeners, snapshot)
+
+    def publish(self, job_id: str, **changes):
+        """Updates the snapshot of a registered job, changes of jobs which are
+        not (or no longer) on the board are ignored."""
+        with self._lock:
+            old = self._jobs.get(job_id)
+            if old is None:
+                return
+            snapshot = {**old, **changes}
+            self._jobs[job_id] = snapshot
+            self._update_index(job_id, old, snapshot)
+            listeners = self._listeners
+        self._notify(listeners, snapshot)
+
+    @staticmethod
+    def _notify(listeners: List[Callable[[Snapshot], None]], snapshot: Snapshot):
+        for listener in listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.warning("Status listener failed", exc_info=e)
+
+    def remove(self, job_id: str) -> Optional[Snapshot]:
+        with self._lock:
+            snapshot = self._jobs.pop(job_id, None)
+            if snapshot is not None:
+                self._update_index(job_id, snapshot, None)
+                del self._sequences[job_id]
+            return snapshot
+
+    def get(self, job_id: str) -> Optional[Snapshot]:
+        return self._jobs.get(job_id)
+
+    def page(
+        self, after: Optional[int], limit: int, filters: Mapping[str, Any]
+    ) -> Tuple[List[Snapshot], Optional[int]]:
+        """Returns the page of snapshots of jobs registered after the cursor
+        `after` (or the first page) and the cursor of the next page, None on
+        the last one."""
+        key = tuple(
+            (name, filters[name]) for name in StatusBoard.FILTER_KEYS if name in filters
+        )
+        with self._lock:
+            index = self._index.get(key, _SortedIndex())
+            page = []
+            last = None
+            for sequence, job_id in index.iterate(after):
+                if len(page) == limit:
+                    return page, last
+                page.append(self._jobs[job_id])
+                last = sequence
+            return page, None